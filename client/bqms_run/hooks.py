@@ -13,7 +13,6 @@
 # limitations under the License.
 """User-defined code that is hooked into the translation workflow."""
 import logging
-import re
 from typing import Mapping
 
 from bqms_run.ksh import KshExtractor
@@ -80,18 +79,24 @@ def custom_pattern_macros_example(
     used by default."""
     # matches something like ${NAME}
     pattern = "\\$\\{(\\w+)\\}"
+    # marks the start and end of an expanded macro
+    prefix = "MACRO_"
+    suffix = "_MACRO"
 
     # ${MACRO_NAME} -> MACRO_NAME_MACRO
     def expand(path: Path, macro_name: str) -> str:  # pylint: disable=unused-argument
-        return "MACRO_" + macro_name + "_MACRO"
+        return prefix + macro_name + suffix
 
     # MACRO_NAME_MACRO -> {NAME}
     def un_expand(
         path: Path, replacement: str, macro_name: str  # pylint: disable=unused-argument
     ) -> str:
-        match = re.match("PARAM_(.+)_PARAM", replacement)
-        if match:
-            unexpanded = match.group(1)
+        if (
+            len(replacement) > len(prefix) + len(suffix)
+            and replacement.startswith(prefix)
+            and replacement.endswith(suffix)
+        ):
+            unexpanded = replacement[len(prefix) : -len(suffix)]
         else:
             unexpanded = macro_name
         return "{" + unexpanded + "}"
@@ -14,9 +14,25 @@
 """Processors for macro/templating langs embedded in code to translate."""
 
 import logging
+import os
 import re
-from fnmatch import fnmatch
-from typing import Callable, Dict, List, Mapping, Match, Optional, Set, Tuple
+from collections import Counter
+from dataclasses import dataclass
+from fnmatch import translate
+from functools import lru_cache
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Match,
+    Optional,
+    Pattern,
+    Set,
+    Tuple,
+    Union,
+    cast,
+)
 
 from marshmallow import Schema, fields, post_load
 
@@ -25,6 +41,45 @@ from bqms_run.paths import Path
 logger = logging.getLogger(__name__)
 
 
+def _compile_macro_pattern(pattern: str, use_re2: bool = False) -> Pattern[str]:
+    """
+    Compiles a case-insensitive macro pattern. If 'use_re2' is set, RE2 is used
+    for linear-time matching when google-re2 is installed and supports the
+    pattern.
+    """
+    if not use_re2:
+        return re.compile(pattern, re.I)
+    try:
+        # pylint: disable-next=import-outside-toplevel
+        import re2
+    except ImportError:
+        logger.warning(
+            "google-re2 is not installed; matching macro pattern '%s' with re.",
+            pattern,
+        )
+        return re.compile(pattern, re.I)
+    options = re2.Options()
+    options.case_sensitive = False
+    options.log_errors = False
+    try:
+        return cast(Pattern[str], re2.compile(pattern, options))
+    except re2.error as error:
+        # RE2 does not support backtracking-only constructs such as
+        # backreferences and lookarounds.
+        logger.warning(
+            "RE2 cannot compile macro pattern '%s' (%s); matching it with re.",
+            pattern,
+            error,
+        )
+        return re.compile(pattern, re.I)
+
+
+@lru_cache(maxsize=4096)
+def _compile_replacement(replacement: str) -> Pattern[str]:
+    """Returns a case-insensitive pattern matching 'replacement' literally."""
+    return re.compile(re.escape(replacement), re.I)
+
+
 class MacroMapping(Schema):
     """Schema and validator for macro mapping."""
 
@@ -59,6 +114,18 @@ class RecordingLogger:  # pylint: disable=too-few-public-methods
         logger.warning(message)
 
 
+@dataclass
+class ReverseMapEntry:
+    """How often a replacement was made, and the original(s) it replaced."""
+
+    count: int
+    originals: Set[str]
+
+    def __getitem__(self, index: int) -> Union[int, Set[str]]:
+        """Index access as '[count, originals]', which entries used to be."""
+        return (self.count, self.originals)[index]
+
+
 class MacroExpander(RecordingLogger):
     """Base class for macro expanders. Do not use this directly."""
 
@@ -66,32 +133,42 @@ class MacroExpander(RecordingLogger):
         super().__init__()
         # macro name -> replacement
         self.mapping = mapping
-        # path -> [replacement -> (count, original(s))]
-        self.reverse: Dict[Path, Dict[str, Tuple[int, Set[str]]]] = {}
+        # path -> [replacement -> ReverseMapEntry], updated in place
+        self.reverse: Dict[Path, Dict[str, ReverseMapEntry]] = {}
 
     def _update_reverse_map(
-        self, path: Path, replacement: str, macro_name: str
+        self, path: Path, replacement: str, macro_name: str, count: int = 1
     ) -> None:
-        if not path in self.reverse:
-            self.reverse[path] = {}
-        reverse_for_path = self.reverse[path]
-        if replacement in reverse_for_path:
-            reverse_for_path[replacement] = (
-                reverse_for_path[replacement][0] + 1,
-                reverse_for_path[replacement][1].union({macro_name}),
-            )
+        reverse_for_path = self.reverse.setdefault(path, {})
+        entry = reverse_for_path.get(replacement)
+        if entry is None:
+            reverse_for_path[replacement] = ReverseMapEntry(count, {macro_name})
         else:
-            reverse_for_path[replacement] = (1, {macro_name})
+            entry.count += count
+            entry.originals.add(macro_name)
+
+    def _un_expansion_pairs(self, path: Path) -> Tuple[List[str], List[str]]:
+        """
+        Returns the replacements made in 'path' and, in a parallel list, the
+        original text to restore for each of them.
+        """
+        reverse_for_path = self.reverse[path]
+        replacements = list(reverse_for_path)
+        originals = [
+            next(iter(reverse_for_path[replacement].originals))
+            for replacement in replacements
+        ]
+        return replacements, originals
 
     def _sanity_check(self, path: Path) -> None:
-        for replacement, originals in self.reverse[path].items():
-            if len(originals[1]) > 1:
+        for replacement, entry in self.reverse[path].items():
+            if len(entry.originals) > 1:
                 self.warn_log(
                     "The value '{0}' was expanded from "
                     + "the following macros: {1}. Un-expansion will not "
                     + "be accurate.",
                     replacement,
-                    str(originals[1]),
+                    str(entry.originals),
                 )
 
     def expand(self, path: Path, text: str) -> str:
@@ -118,13 +195,15 @@ class SimpleMacroExpander(MacroExpander):
         if path not in self.reverse:
             return text
         self._sanity_check(path)
-        for substitution_text, original in self.reverse[path].items():
-            original_text = original[1].pop()
+        substitution_texts, original_texts = self._un_expansion_pairs(path)
+        for substitution_text, original_text in zip(substitution_texts, original_texts):
             text = text.replace(substitution_text, original_text)
         return text
 
 
-class PatternMacroExpander(MacroExpander):
+class PatternMacroExpander(  # pylint: disable=too-many-instance-attributes
+    MacroExpander
+):
     """Handles expanding and un-expanding macros in a user-customizable way."""
 
     def __init__(
@@ -133,13 +212,16 @@ class PatternMacroExpander(MacroExpander):
         mapping: Mapping[str, str],
         generator: Optional[Callable[[Path, str], str]] = None,
         un_generator: Optional[Callable[[Path, str, str], str]] = None,
+        use_re2: bool = False,
     ) -> None:
         """
         Args:
             pattern: A regular expression that should match the macros in the
                 input paths. The expression should have a group that matches the
                 name of the macro.
-            mapping: An optional mapping of macro names to their expanded value
+            mapping: An optional mapping of macro names to their expanded value.
+                Since 'pattern' matches case-insensitively, macro names without
+                an exact match are looked up case-insensitively as well.
             generator: An optional function that will be used to expand macros
                 that were not matched by the 'mapping'. Takes the path and
                 the macro name (from the 'pattern' group) and returns a string.
@@ -147,25 +229,40 @@ class PatternMacroExpander(MacroExpander):
                 macro. Takes a path, the fully expanded macro, and its
                 original name. Returns the text to substitute back into the
                 result as a string.
+            use_re2: Whether to match 'pattern' with RE2 (requires google-re2)
+                for linear-time matching. Note that RE2's \\w and \\b only
+                match ASCII word characters.
         """
         super().__init__(mapping)
-        self.pattern = re.compile(pattern, re.I)
+        self.pattern = _compile_macro_pattern(pattern, use_re2)
         self.generator = generator
         self.un_generator = un_generator
+        # lowercased macro name -> replacement
+        self._folded_mapping = (
+            {name.lower(): value for name, value in mapping.items()} if mapping else {}
+        )
         # path -> unmapped macros
         self.unmapped: Dict[Path, Set[str]] = {}
-
-    def _substitution(self, path: Path, match: Match[str]) -> str:
-
-        macro_name = match.group(1)
-        full_match = match.group(0)
-        if self.mapping and macro_name in self.mapping:
-            generated = self.mapping[macro_name]
+        # Expanders that only generate replacements skip the mapping lookups.
+        self._substitute: Callable[[Path, str, str], str] = (
+            self._generator_substitution
+            if generator and not mapping
+            else self._substitution
+        )
+
+    def _substitution(self, path: Path, macro_name: str, full_match: str) -> str:
+        mapping = self.mapping
+        folded_mapping = self._folded_mapping
+        # The macro name group may not have participated in the match.
+        folded_name = (
+            macro_name.lower() if folded_mapping and macro_name is not None else None
+        )
+        if mapping and macro_name in mapping:
+            generated = mapping[macro_name]
+        elif folded_name is not None and folded_name in folded_mapping:
+            generated = folded_mapping[folded_name]
         elif self.generator:
-            if path in self.unmapped:
-                self.unmapped[path].union(macro_name)
-            else:
-                self.unmapped[path] = {macro_name}
+            self.unmapped.setdefault(path, set()).add(macro_name)
             generated = self.generator(path, macro_name)
         else:
             self.warn_log(
@@ -175,9 +272,18 @@ class PatternMacroExpander(MacroExpander):
                 full_match,
             )
             generated = full_match
-        self._update_reverse_map(path, generated, full_match)
         return generated
 
+    def _generator_substitution(
+        self,
+        path: Path,
+        macro_name: str,
+        full_match: str,  # pylint: disable=unused-argument
+    ) -> str:
+        # _substitution for an expander with a generator but no mapping.
+        self.unmapped.setdefault(path, set()).add(macro_name)
+        return cast(Callable[[Path, str], str], self.generator)(path, macro_name)
+
     def expand(self, path: Path, text: str) -> str:
         """
         Expands all macros in the given input text
@@ -186,7 +292,46 @@ class PatternMacroExpander(MacroExpander):
             text: The text containing macro uses
         Returns: 'text' with its macro uses expanded
         """
-        return self.pattern.sub(lambda match: self._substitution(path, match), text)
+        parts: List[str] = []
+        expansions: "Counter[Tuple[str, str]]" = Counter()
+        # Bound once since they are used for every match.
+        append = parts.append
+        substitution = self._substitute
+        end = 0
+        # finditer yields matches lazily, so no list of matches is ever built.
+        for match in self.pattern.finditer(text):
+            full_match, macro_name = match.group(0, 1)
+            generated = substitution(path, macro_name, full_match)
+            expansions[generated, full_match] += 1
+            append(text[end : match.start()])
+            append(generated)
+            end = match.end()
+        append(text[end:])
+        for (generated, full_match), count in expansions.items():
+            self._update_reverse_map(path, generated, full_match, count)
+        return "".join(parts)
+
+    def _build_un_expansion(self, path: Path) -> Tuple[Pattern[str], List[str]]:
+        # Longest replacements first so that a replacement which is a prefix of
+        # another one cannot shadow it in the alternation.
+        pairs = sorted(
+            zip(*self._un_expansion_pairs(path)),
+            key=lambda pair: len(pair[0]),
+            reverse=True,
+        )
+        un_expansions = []
+        for replacement, original_text in pairs:
+            if self.un_generator:
+                un_expansions.append(
+                    self.un_generator(path, replacement, original_text)
+                )
+            else:
+                un_expansions.append(original_text)
+        pattern = re.compile(
+            "|".join(f"({re.escape(replacement)})" for replacement, _ in pairs),
+            re.I if self.un_generator else 0,
+        )
+        return pattern, un_expansions
 
     def un_expand(self, path: Path, text: str) -> str:
         """
@@ -199,19 +344,12 @@ class PatternMacroExpander(MacroExpander):
         if path not in self.reverse:
             return text
         self._sanity_check(path)
-        for replacement, original in self.reverse[path].items():
-            original_text = original[1].pop()
-            if self.un_generator:
-                result = re.subn(
-                    re.escape(replacement),
-                    self.un_generator(path, replacement, original_text),
-                    text,
-                    flags=re.I,
-                )
-            else:
-                result = re.subn(re.escape(replacement), original_text, text)
-            text = result[0]
-        return text
+        # Not cached: the workflow un-expands each path once, so keeping the
+        # alternation around would only grow memory with the corpus size.
+        pattern, un_expansions = self._build_un_expansion(path)
+        return pattern.sub(
+            lambda match: un_expansions[cast(int, match.lastindex) - 1], text
+        )
 
 class ParameterAwareMacroExpander(MacroExpander):
     """Handles expanding and un-expanding macros from custom templating to valid parametrized script."""
@@ -223,6 +361,7 @@ class ParameterAwareMacroExpander(MacroExpander):
         mapping: Mapping[str, str],
         source_bind_generator: Optional[Callable[[Path, str], str]] = None,
         target_bind_generator: Optional[Callable[[Path, str, str], str]] = None,
+        use_re2: bool = False,
     ) -> None:
         """
         Args:
@@ -233,11 +372,12 @@ class ParameterAwareMacroExpander(MacroExpander):
             value_stripper: Regex to trim obfuscated value in order to detect type
             source_bind_generator: A function that format parameter in a way that it's detected as bind parameter in source dialect
             target_bind_generator: A function that format parameter in a way that it's detected as bind parameter in target dialect
+            use_re2: Whether to match 'pattern' with RE2 (requires google-re2)
         """
         super().__init__(mapping)
         # what if we have mapping and wrap it here.
         pattern = f"([=\\(, \\[]?){pattern}"
-        self.pattern = re.compile(pattern, re.I)
+        self.pattern = _compile_macro_pattern(pattern, use_re2)
         self.source_bind_generator = source_bind_generator
         self.target_bind_generator = target_bind_generator
         # path -> unmapped macros
@@ -245,9 +385,7 @@ class ParameterAwareMacroExpander(MacroExpander):
         self.value_stripper = re.compile(value_stripper)
 
     def _substitution(self, path: Path, match: Match[str]) -> str:
-        prefix = match.group(1)
-        macro_name = match.group(2)
-        full_match = match.group(0)
+        full_match, prefix, macro_name = match.group(0, 1, 2)
         if self.mapping and macro_name in self.mapping:
             replacement = self.mapping[macro_name]
             stripped_replacement = self.value_stripper.match(replacement).group(1)
@@ -289,15 +427,9 @@ class ParameterAwareMacroExpander(MacroExpander):
         if path not in self.reverse:
             return text
         self._sanity_check(path)
-        for replacement, original in self.reverse[path].items():
-            original_text = original[1].pop()
-            result = re.subn(
-                    re.escape(replacement),
-                    original_text,
-                    text,
-                    flags=re.I,
-            )
-            text = result[0]
+        replacements, original_texts = self._un_expansion_pairs(path)
+        for replacement, original_text in zip(replacements, original_texts):
+            text = _compile_replacement(replacement).sub(original_text, text)
         return text
 
 class MacroExpanderRouter(RecordingLogger):
@@ -313,11 +445,40 @@ class MacroExpanderRouter(RecordingLogger):
         """
         super().__init__()
         self.all_macros = all_macros
+        regexes = [translate(os.path.normcase(pattern)) for pattern in all_macros]
+        self._compiled = [
+            (re.compile(regex), expander)
+            for regex, expander in zip(regexes, all_macros.values())
+        ]
+        # Matches the first glob pattern, in order, that matches a path.
+        self._first_match = re.compile(
+            "|".join(f"(?P<glob{index}>{regex})" for index, regex in enumerate(regexes))
+        )
+        # Set when every pattern shares one expander, so the matching patterns
+        # need not be looked up since it is only applied once anyway.
+        expanders = list(all_macros.values())
+        self._only_expander = (
+            expanders[0]
+            if expanders and all(expander is expanders[0] for expander in expanders)
+            else None
+        )
 
     def _choose_expanders(self, path: Path) -> List[MacroExpander]:
-        chosen_expanders = []
-        for pattern, expander in self.all_macros.items():
-            if fnmatch(str(path), pattern):
+        file_name = os.path.normcase(str(path))
+        match = self._first_match.fullmatch(file_name)
+        if not match:
+            return []
+        if self._only_expander is not None:
+            return [self._only_expander]
+        index = int(cast(str, match.lastgroup)[len("glob") :])
+        chosen_expanders = [self._compiled[index][1]]
+        # Earlier patterns cannot match or the alternation would have chosen
+        # them, but later ones still might.
+        # An expander shared by several matching patterns is applied once.
+        for regex, expander in self._compiled[index + 1 :]:
+            if regex.match(file_name) and all(
+                expander is not chosen for chosen in chosen_expanders
+            ):
                 chosen_expanders.append(expander)
         return chosen_expanders
 
@@ -18,10 +18,10 @@ import logging
 import os
 import signal
 import sys
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Executor, ThreadPoolExecutor
 from pprint import pformat
 from types import FrameType
-from typing import Dict, Mapping, Optional
+from typing import Dict, Mapping, Optional, Tuple, Type
 
 import yaml
 from cloudpathlib.cloudpath import register_path_class
@@ -41,12 +41,28 @@ from bqms_run.hooks import preprocess as preprocess_hook
 from bqms_run.macros import MacroExpanderRouter, MacroMapping
 from bqms_run.paths import Path, Paths
 
+try:
+    # libyaml-backed loader is much faster when PyYAML was built with it.
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader  # type: ignore[assignment]
+
 root_logger = logging.getLogger()
 logger = logging.getLogger("bqms_run")
 # urllib3 can be noisy
 logging.getLogger("urllib3").setLevel(logging.ERROR)
 
 
+class _LazyPformat:  # pylint: disable=too-few-public-methods
+    """Defers pformat of an object until a log record is actually emitted."""
+
+    def __init__(self, obj: object) -> None:
+        self.obj = obj
+
+    def __str__(self) -> str:
+        return pformat(self.obj)
+
+
 def _parse_paths() -> Paths:
     logger.debug("Parsing BQMS_*_PATH env vars.")
     paths_mapping = {
@@ -81,7 +97,7 @@ def _read_config(config_path: Path) -> Dict[str, object]:
     logger.debug("Parsing config: %s.", config_path.as_uri())
     with config_path.open(mode="rb") as config_file:
         config_text = EncodingDetector().decode(config_file.read())
-    config: Dict[str, object] = yaml.load(config_text, Loader=yaml.SafeLoader)
+    config: Dict[str, object] = yaml.load(config_text, Loader=SafeLoader)
     return config
 
 
@@ -164,7 +180,7 @@ def _parse_object_name_mapping(
         sys.exit(1)
     logger.debug(
         "Object name mapping:\n%s",
-        pformat(object_name_mapping_list),
+        _LazyPformat(object_name_mapping_list),
     )
     return object_name_mapping_list
 
@@ -173,7 +189,7 @@ def _parse_macro_mapping(macro_mapping_path: Path) -> MacroExpanderRouter:
     logger.debug("Parsing macro mapping: %s.", macro_mapping_path.as_uri())
     with macro_mapping_path.open(mode="rb") as macro_mapping_file:
         macro_mapping_text = EncodingDetector().decode(macro_mapping_file.read())
-    macro_mapping = yaml.load(macro_mapping_text, Loader=yaml.SafeLoader)
+    macro_mapping = yaml.load(macro_mapping_text, Loader=SafeLoader)
     try:
         validated_macro_mapping = MacroMapping.from_mapping(macro_mapping)
     except ValidationError as error:
@@ -185,11 +201,36 @@ def _parse_macro_mapping(macro_mapping_path: Path) -> MacroExpanderRouter:
     # migration workflow request.
     logger.info(
         "Macro mapping:\n%s.",
-        pformat(validated_macro_mapping),
+        _LazyPformat(validated_macro_mapping),
     )
     return custom_macros(validated_macro_mapping)
 
 
+def _parse_mappings(
+    paths: Paths, executor_factory: Type[Executor]
+) -> Tuple[Optional[ObjectNameMappingList], Optional[MacroExpanderRouter]]:
+    # Both mappings are read from (possibly remote) paths, so parse them
+    # concurrently when multithreaded.
+    with executor_factory() as executor:
+        object_name_mapping_future = (
+            executor.submit(_parse_object_name_mapping, paths.object_name_mapping_path)
+            if paths.object_name_mapping_path
+            else None
+        )
+        macro_mapping_future = (
+            executor.submit(_parse_macro_mapping, paths.macro_mapping_path)
+            if paths.macro_mapping_path
+            else None
+        )
+    object_name_mapping_list = (
+        object_name_mapping_future.result() if object_name_mapping_future else None
+    )
+    macro_expander_router = (
+        macro_mapping_future.result() if macro_mapping_future else None
+    )
+    return object_name_mapping_list, macro_expander_router
+
+
 class LoggingFormatter(logging.Formatter):
     """Color-coded logging.Formatter."""
 
@@ -257,10 +298,12 @@ def main() -> None:
     logger.info("Parsing env vars and config files.")
 
     logger.debug("Parsing BQMS_MULTITHREADED.")
-    multithreaded = (
-        os.getenv("BQMS_MULTITHREADED", "False").lower() in true_env_var_values
+    executor_factory: Type[Executor] = (
+        ThreadPoolExecutor
+        if os.getenv("BQMS_MULTITHREADED", "False").lower() in true_env_var_values
+        else workflow.SynchronousExecutor
     )
-    logger.debug("Multithreaded: %s.", multithreaded)
+    logger.debug("Executor: %s.", executor_factory.__name__)
 
     logger.debug("Parsing BQMS_PROJECT.")
     project = os.getenv("BQMS_PROJECT")
@@ -282,10 +325,8 @@ def main() -> None:
     translation_type = _parse_translation_type(config)
     source_env = _parse_source_env(config)
 
-    object_name_mapping_list = (
-        _parse_object_name_mapping(paths.object_name_mapping_path)
-        if paths.object_name_mapping_path
-        else None
+    object_name_mapping_list, macro_expander_router = _parse_mappings(
+        paths, executor_factory
     )
 
     bqms_request = build_bqms_request(
@@ -298,12 +339,6 @@ def main() -> None:
         object_name_mapping_list,
     )
 
-    macro_expander_router = (
-        _parse_macro_mapping(paths.macro_mapping_path)
-        if paths.macro_mapping_path
-        else None
-    )
-
     try:
         logger.info("Executing BQMS workflow.")
         workflow.execute(
@@ -312,7 +347,7 @@ def main() -> None:
             postprocess_hook,
             bqms_request,
             macro_expander_router,
-            ThreadPoolExecutor if multithreaded else workflow.SynchronousExecutor,
+            executor_factory,
         )
     except Exception as exc:  # pylint: disable=broad-except
         logger.error("An unexpected error occurred:")
@@ -0,0 +1,29 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Hooks unit tests."""
+import pathlib
+
+from bqms_run.hooks import custom_pattern_macros_example
+
+
+def test_custom_pattern_macros_example():
+    """The example pattern macro processor should expand macros missing from
+    the mapping to MACRO_<name>_MACRO and un-expand them to {<name>}."""
+    expander = custom_pattern_macros_example({"*.sql": {"a": "alpha"}})
+    path = pathlib.Path("abc.sql")
+    expanded = expander.expand(path, "select ${a}, ${foo} from ${MACRO_}")
+    assert expanded == "select alpha, MACRO_foo_MACRO from MACRO_MACRO__MACRO"
+    un_expanded = expander.un_expand(path, expanded)
+    assert un_expanded == "select {${a}}, {foo} from {MACRO_}"
@@ -16,8 +16,11 @@
 import pathlib
 import re
 
+import pytest
+
 from bqms_run.macros import (
     MacroExpanderRouter,
+    ParameterAwareMacroExpander,
     PatternMacroExpander,
     SimpleMacroExpander,
 )
@@ -160,3 +163,242 @@ def test_basic_expand():
     assert expanded == "abcdef alpha.bravo ghijkl"
     un_expanded = expander.un_expand(pathlib.Path("abc.sql"), expanded)
     assert un_expanded == input_text
+
+
+def test_overlapping_unexpand():
+    """Un-expansion should prefer the longest replacement when one replacement
+    is a prefix of another."""
+    expander = MacroExpanderRouter(
+        {
+            "*.sql": PatternMacroExpander(
+                mapping={"a": "abc", "b": "abcdef"},
+                pattern="\\$\\{(\\w+)\\}",
+            )
+        }
+    )
+    input_text = "${a} ${b} ${a}"
+    expanded = expander.expand(pathlib.Path("abc.sql"), input_text)
+    assert expanded == "abc abcdef abc"
+    un_expanded = expander.un_expand(pathlib.Path("abc.sql"), expanded)
+    assert un_expanded == input_text
+
+
+def test_multiple_glob_patterns():
+    """Every expander whose glob pattern matches a path should be applied, in
+    order, and paths matching no pattern should be left untouched."""
+    expander = MacroExpanderRouter(
+        {
+            "*.bteq": SimpleMacroExpander(mapping={"${a}": "alpha"}),
+            "*.sql": SimpleMacroExpander(mapping={"${a}": "${b}"}),
+            "*/*.sql": SimpleMacroExpander(mapping={"${b}": "bravo"}),
+        }
+    )
+    input_text = "${a}"
+    assert expander.expand(pathlib.Path("abc.sql"), input_text) == "${b}"
+    assert expander.expand(pathlib.Path("dir/abc.sql"), input_text) == "bravo"
+    assert expander.expand(pathlib.Path("abc.bteq"), input_text) == "alpha"
+    assert expander.expand(pathlib.Path("abc.ksh"), input_text) == input_text
+
+
+def test_unmapped_macros():
+    """Macros expanded by the generator rather than the mapping should be
+    recorded per path."""
+    pattern_expander = PatternMacroExpander(
+        mapping={"a": "alpha"},
+        pattern="\\$\\{(\\w+)\\}",
+        generator=lambda path, text: text.upper(),
+    )
+    path = pathlib.Path("abc.sql")
+    expanded = pattern_expander.expand(path, "${a} ${b} ${cd} ${b}")
+    assert expanded == "alpha B CD B"
+    assert pattern_expander.unmapped == {path: {"b", "cd"}}
+
+
+def test_generator_called_per_occurrence():
+    """The generator should be invoked for every macro occurrence, and each
+    occurrence should be counted for un-expansion."""
+    calls = []
+
+    def generator(path, macro_name):  # pylint: disable=unused-argument
+        calls.append(macro_name)
+        return "P" + str(len(calls) - 1)
+
+    pattern_expander = PatternMacroExpander(
+        mapping={}, pattern="\\$\\{(\\w+)\\}", generator=generator
+    )
+    path = pathlib.Path("abc.sql")
+    expanded = pattern_expander.expand(path, "${a} ${b} ${a} ${a}")
+    assert expanded == "P0 P1 P2 P3"
+    assert calls == ["a", "b", "a", "a"]
+    generator_pattern_expander = PatternMacroExpander(
+        mapping={},
+        pattern="\\$\\{(\\w+)\\}",
+        generator=lambda path, macro_name: "PARAM_" + macro_name + "_PARAM",
+    )
+    generator_pattern_expander.expand(path, "${a} ${b} ${a} ${a}")
+    entry = generator_pattern_expander.reverse[path]["PARAM_a_PARAM"]
+    assert entry.count == 3
+    # Entries are still indexable like the lists they replaced.
+    assert (entry[0], entry[1]) == (3, {"${a}"})
+
+
+def test_missing_replacement_warned_per_occurrence():
+    """Each occurrence of a macro that cannot be expanded should be warned
+    about."""
+    expander = MacroExpanderRouter(
+        {"*.sql": PatternMacroExpander(mapping={}, pattern="\\$\\{(\\w+)\\}")}
+    )
+    expander.expand(pathlib.Path("abc.sql"), "${c} ${c}")
+    assert len(expander.all_messages()) == 2
+
+
+def test_repeated_unexpand():
+    """Un-expansion should not consume the reverse mapping, so un-expanding
+    the same path more than once gives the same result."""
+    expander = MacroExpanderRouter(
+        {
+            "*.sql": SimpleMacroExpander(mapping={"${a}": "alpha"}),
+            "*.bteq": PatternMacroExpander(
+                mapping={"a": "alpha"}, pattern="\\$\\{(\\w+)\\}"
+            ),
+        }
+    )
+    for path in (pathlib.Path("abc.sql"), pathlib.Path("abc.bteq")):
+        expanded = expander.expand(path, "${a} abc")
+        assert expander.un_expand(path, expanded) == "${a} abc"
+        assert expander.un_expand(path, expanded) == "${a} abc"
+
+
+def test_case_insensitive_mapping():
+    """Macro names should fall back to a case-insensitive mapping lookup, as
+    the pattern itself matches case-insensitively."""
+    expander = MacroExpanderRouter(
+        {
+            "*.sql": PatternMacroExpander(
+                mapping={"a": "alpha", "A": "ALPHA", "b": "bravo"},
+                pattern="\\$\\{(\\w+)\\}",
+            )
+        }
+    )
+    input_text = "${a} ${A} ${B}"
+    expanded = expander.expand(pathlib.Path("abc.sql"), input_text)
+    assert expanded == "alpha ALPHA bravo"
+    assert not expander.all_messages()
+
+
+def test_shared_expander_applied_once():
+    """An expander shared by several matching glob patterns should only be
+    applied once to a path."""
+    pattern_expander = PatternMacroExpander(
+        mapping={"a": "${b}", "b": "bravo"},
+        pattern="\\$\\{(\\w+)\\}",
+    )
+    bteq_expander = PatternMacroExpander(
+        mapping={"a": "alpha"},
+        pattern="\\$\\{(\\w+)\\}",
+    )
+    expander = MacroExpanderRouter(
+        {
+            "*.sql": pattern_expander,
+            "*/*.sql": pattern_expander,
+            "*.bteq": bteq_expander,
+        }
+    )
+    input_text = "${a}"
+    expanded = expander.expand(pathlib.Path("dir/abc.sql"), input_text)
+    assert expanded == "${b}"
+    assert expander.expand(pathlib.Path("abc.bteq"), input_text) == "alpha"
+    assert expander.expand(pathlib.Path("abc.txt"), input_text) == input_text
+
+
+def test_generator_only_replacement():
+    """Expanders without a mapping should expand every macro through the
+    generator and record it as unmapped."""
+    pattern_expander = PatternMacroExpander(
+        mapping={},
+        pattern="\\$\\{(\\w+)\\}",
+        generator=lambda path, macro_name: "PARAM_" + macro_name + "_PARAM",
+    )
+    path = pathlib.Path("abc.sql")
+    input_text = "${a} ${b} ${a}"
+    expanded = pattern_expander.expand(path, input_text)
+    assert expanded == "PARAM_a_PARAM PARAM_b_PARAM PARAM_a_PARAM"
+    assert pattern_expander.unmapped == {path: {"a", "b"}}
+    assert pattern_expander.un_expand(path, expanded) == input_text
+
+
+def test_optional_macro_name_group():
+    """A pattern whose macro name group is optional should not break the
+    mapping lookup when that group does not participate in a match."""
+    expander = MacroExpanderRouter(
+        {
+            "*.sql": PatternMacroExpander(
+                mapping={"A": "alpha"},
+                pattern="\\$(?:\\{(\\w+)\\}|x)",
+            )
+        }
+    )
+    input_text = "${a} $x"
+    expanded = expander.expand(pathlib.Path("abc.sql"), input_text)
+    assert expanded == "alpha $x"
+    assert expander.all_messages()[0].startswith("Could not expand '$x'")
+
+
+def test_re2_is_opt_in():
+    """Macro patterns should only be matched with RE2 when requested, since
+    RE2's \\w is ASCII-only."""
+    pattern_expander = PatternMacroExpander(
+        mapping={"é": "e_acute"}, pattern="\\$\\{(\\w+)\\}"
+    )
+    assert isinstance(pattern_expander.pattern, re.Pattern)
+    path = pathlib.Path("abc.sql")
+    assert pattern_expander.expand(path, "${é}") == "e_acute"
+
+
+def test_re2_pattern_expansion():
+    """Pattern expansion and un-expansion should work on the RE2 path."""
+    pytest.importorskip("re2")
+    pattern_expander = PatternMacroExpander(
+        mapping={"a": "alpha"},
+        pattern="\\$\\{(\\w+)\\}",
+        generator=lambda path, macro_name: "PARAM_" + macro_name + "_PARAM",
+        use_re2=True,
+    )
+    assert not isinstance(pattern_expander.pattern, re.Pattern)
+    path = pathlib.Path("abc.sql")
+    input_text = "${a} ${B} ${a} ${é}"
+    expanded = pattern_expander.expand(path, input_text)
+    assert expanded == "alpha PARAM_B_PARAM alpha ${é}"
+    assert pattern_expander.un_expand(path, expanded) == input_text
+
+
+def test_re2_parameter_aware_expansion():
+    """Parameter-aware expansion, which uses the pattern's sub, should work on
+    the RE2 path."""
+    pytest.importorskip("re2")
+    pattern_expander = ParameterAwareMacroExpander(
+        pattern="\\$\\{(\\w+)\\}",
+        value_stripper="'?([^']*)'?",
+        mapping={"a": "5", "b": "'x'"},
+        source_bind_generator=lambda value: ":" + value,
+        target_bind_generator=lambda value: "@" + value,
+        use_re2=True,
+    )
+    assert not isinstance(pattern_expander.pattern, re.Pattern)
+    path = pathlib.Path("abc.sql")
+    input_text = "where c=${a} and d=${b}"
+    expanded = pattern_expander.expand(path, input_text)
+    assert expanded == "where c=:5 and d='x'"
+    assert pattern_expander.un_expand(path, "where c=@5 and d='x'") == input_text
+
+
+def test_re2_unsupported_pattern_falls_back(caplog):
+    """Patterns that RE2 cannot compile should fall back to re, with a
+    warning."""
+    pytest.importorskip("re2")
+    pattern_expander = PatternMacroExpander(
+        mapping={"a": "alpha"}, pattern="(?<=\\$)\\{(\\w+)\\}", use_re2=True
+    )
+    assert "(?<=\\$)\\{(\\w+)\\}" in caplog.text
+    assert isinstance(pattern_expander.pattern, re.Pattern)
+    assert pattern_expander.expand(pathlib.Path("abc.sql"), "${a}") == "$alpha"